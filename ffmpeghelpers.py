@@ -1,8 +1,16 @@
 import ffmpeg
 import json 
+import subprocess
 
-properties = ["width", "height", "codec_name", "avg_frame_rate", "duration"]
+properties = frozenset(["width", "height", "codec_name", "avg_frame_rate", "duration"])
 video = "LOL.mp4"
+probe_timeout = 30      #seconds before a stuck ffprobe is killed
+
+class ProbeTimeoutError(TimeoutError):
+    """
+    ffprobe did not finish within probe_timeout
+    """
+
 def vidprop(video, properties):
     """
     The function takes the video as the input and returns a dictionary 
@@ -10,10 +18,25 @@ def vidprop(video, properties):
      
     >>> {'codec_name': 'h264', 'width': 1080, 'height': 720}
     """
-    probe = ffmpeg.probe(video)     #uses ffmpeg method to collate video properties
-    for s in probe["streams"]:          #the properties sit as a dic in an array under the key "streams"
-        if s["codec_type"] == "video":      # checks that it is a video
-            x = {k:v for k,v in s.items() if k in properties}
+    #same command as ffmpeg.probe, run directly so it can time out
+    try:
+        result = subprocess.run(
+            ["ffprobe", "-v", "error", "-show_format", "-show_streams", "-of", "json", video],
+            capture_output=True, check=True, timeout=probe_timeout,
+        )
+    except subprocess.TimeoutExpired:
+        raise ProbeTimeoutError(f"ffprobe timed out after {probe_timeout}s on {video}") from None
+    except subprocess.CalledProcessError as e:
+        raise ffmpeg.Error("ffprobe", e.stdout, e.stderr) from None
+    except OSError as e:
+        #a missing ffprobe binary would otherwise look like a missing video
+        raise ffmpeg.Error("ffprobe", b"", str(e).encode()) from None
+    probe = json.loads(result.stdout)     #collates video properties
+    s = next((s for s in probe["streams"] if s.get("codec_type") == "video"), None)   #first stream in "streams" that is a video
+    if s is None:
+        raise ValueError(f"No video stream found in {video}")
+    x = {k:v for k,v in s.items() if k in properties}
     return x
 
-print(vidprop(video,properties))
\ No newline at end of file
+if __name__ == "__main__":
+    print(vidprop(video,properties))
@@ -1,35 +1,95 @@
 """
-Version with dynamic property list and normalise function
+Version with dynamic property list and a type schema for the metadata
 """
 
+from functools import lru_cache
 import ffmpeg
 import json
 import os
-from typing import Dict, List
-from fractions import Fraction
+import stat
+import subprocess
+from typing import Collection, Dict
 
-standard_properties = ["width", "height", "codec_name", "avg_frame_rate", "duration"]
+#seconds before a stuck ffprobe is killed, None waits forever
+PROBE_TIMEOUT = 30
 
-def normalise(metadata: dict, float_precision: int = 2) -> dict:
+#frozenset so the "k in properties" check per stream key is a hash lookup
+STANDARD_PROPERTIES = frozenset(["width", "height", "codec_name", "avg_frame_rate", "duration"])
+
+class ProbeTimeoutError(TimeoutError):
     """
-    Ensure consistent types for metadata:
-      - Integers and Floats are rounded to N=2 decimal places
-      - Strings remain as-is
+    ffprobe did not finish within PROBE_TIMEOUT
     """
-    normalised = {}
-    for k, v in metadata.items():
-        try:
-            num = float(v)
-            normalised[k] = round(num, float_precision)
-        except (ValueError, TypeError):
-            normalised[k] = v
-    return normalised
-
-def vidprop(video_path: str, properties: List[str] = standard_properties) -> Dict:
+
+
+def _probe_cached(video_path: str, st: os.stat_result) -> Dict:
+    """
+    Returns ffprobe output for video_path (same shape as ffmpeg.probe), only
+    spawning ffprobe when the file has not been probed since it last changed
+
+    Keyed by (path, size, mtime) like v3, but kept in memory only since this
+    version needs every stream field and v3's <video>.probe.json sidecar
+    holds a trimmed probe
+
+    The returned dict is shared between callers and must not be mutated
+    """
+    return _probe_for_key(os.path.abspath(video_path), st.st_size, st.st_mtime_ns)
+
+
+@lru_cache(maxsize=128)
+def _probe_for_key(abspath: str, size: int, mtime_ns: int) -> Dict:
+    #same command as ffmpeg.probe, run directly since ffmpeg.probe can't take a timeout
+    try:
+        result = subprocess.run(
+            ["ffprobe", "-v", "error", "-show_format", "-show_streams", "-of", "json", abspath],
+            capture_output=True, check=True, timeout=PROBE_TIMEOUT,
+        )
+    except subprocess.TimeoutExpired:
+        raise ProbeTimeoutError(f"ffprobe timed out after {PROBE_TIMEOUT}s on {abspath}") from None
+    except subprocess.CalledProcessError as e:
+        raise ffmpeg.Error("ffprobe", e.stdout, e.stderr) from None
+    except OSError as e:
+        #a missing ffprobe binary would otherwise look like a missing video
+        raise ffmpeg.Error("ffprobe", b"", str(e).encode()) from None
+    return json.loads(result.stdout)
+
+
+def to_number(value, float_precision: int = 2):
+    """
+    Turns numeric strings from ffprobe into numbers without relying on exceptions:
+      - Integers stay integers
+      - Floats are rounded to N=2 decimal places
+      - Anything else remains as-is
+    """
+    if isinstance(value, float):
+        return round(value, float_precision)
+    if not isinstance(value, str):
+        return value
+    #only one leading minus, "--5" is not a number
+    digits = value[1:] if value.startswith("-") else value
+    if digits.isdigit():
+        return int(value)
+    if "." in digits and digits.replace(".", "", 1).isdigit():
+        return round(float(value), float_precision)
+    return value
+
+#expected type of each standard field, any other requested property goes through to_number
+schema = {
+    "filename": str,
+    "file_size": int,
+    "width": int,
+    "height": int,
+    "codec_name": str,
+    "avg_frame_rate": float,
+    "duration": lambda v: round(float(v), 2),
+}
+
+def vidprop(video_path: str, properties: Collection[str] = STANDARD_PROPERTIES) -> Dict:
     """
     Extracts key metadata from video file 
 
-    Key metadata can be specified with optional argument
+    Key metadata can be specified with optional argument, any collection
+    works (a list is fine) but a set or frozenset gives the fastest lookups
 
     Always outputs file name and size
 
@@ -46,41 +106,44 @@ def vidprop(video_path: str, properties: List[str] = standard_properties) -> Dic
     Raises:
             FileNotFound if file does not exist
             ValueError if no video type file is found 
+            ProbeTimeoutError if ffprobe takes longer than PROBE_TIMEOUT
+            ffmpeg.Error if ffprobe fails or is not installed
     """
 
-    #checks if video exists
-    if os.path.isfile(video_path) == False:                     
-        raise FileNotFoundError(f"{video_path} not found") 
+    #checks if video exists, one stat call also gives the file size
+    try:
+        st = os.stat(video_path)
+    except OSError:
+        raise FileNotFoundError(f"{video_path} not found") from None
+    if not stat.S_ISREG(st.st_mode):
+        raise FileNotFoundError(f"{video_path} not found")
     
     #gets filename and file size (not in our probe)
     fileprops = {
         "filename": os.path.basename(video_path),
-        "file_size": os.path.getsize(video_path),
+        "file_size": st.st_size,
     }
     
     #gets main properties
-    probe = ffmpeg.probe(video_path)                                        #uses ffmpeg method to collate video properties
-    vidprops = None
-    for prop in probe["streams"]:                                           #the properties sit as a dic in an array under the key "streams"
-        if prop["codec_type"] == "video":                                   # checks that it is a video
-            vidprops = {k:v for k,v in prop.items() if k in properties}
-            break                                                           # avoids overwriting if multiple video streams 
-    if vidprops == None:                                                
-        raise ValueError(f"No video stream found in {video_path}")          
+    probe = _probe_cached(video_path, st)                                    #uses ffprobe to collate video properties
+    #the properties sit as a dic in an array under the key "streams", takes the first video stream
+    prop = next((s for s in probe["streams"] if s.get("codec_type") == "video"), None)
+    if prop is None:
+        raise ValueError(f"No video stream found in {video_path}")
+    vidprops = {k:v for k,v in prop.items() if k in properties}
     
-    #Turn fps to float
+    #Turn fps to float, ffprobe always gives "num/den"
+    num, _, den = str(vidprops.get("avg_frame_rate", "")).partition("/")
     try:
-        fps_fraction = Fraction(vidprops.get("avg_frame_rate"))
-        fps_float = round(float(fps_fraction),2)
-        vidprops["avg_frame_rate"] = fps_float
-    except: 
+        vidprops["avg_frame_rate"] = round(float(num) / float(den) if den else float(num), 2)
+    except (ValueError, ZeroDivisionError):
         vidprops["avg_frame_rate"] = 0
     
     raw_metadata = (fileprops | vidprops)
-    normalised_metadata = normalise(raw_metadata)
-    return normalised_metadata
+    return {k: schema.get(k, to_number)(v) for k, v in raw_metadata.items()}
 
-print(vidprop("LOL.mp4"))
+if __name__ == "__main__":
+    print(vidprop("LOL.mp4"))
 
 
 '''
@@ -1,12 +1,535 @@
-from datetime import datetime
+import asyncio
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache
+import itertools
 import ffmpeg
 import json
+import operator
 import os
-from typing import Dict
-from fractions import Fraction
-import uuid 
+import shlex
+import signal
+import stat
+import struct
+import subprocess
+import tempfile
+import threading
+import time
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+#orjson parses the ffprobe json a few times faster, the standard library is the fallback
+try:
+    from orjson import loads as _json_loads
+except ImportError:
+    from json import loads as _json_loads
+
+#bump when the probe output changes shape so older sidecars are ignored
+_SIDECAR_VERSION = 2
+
+#in-memory probe cache, (abspath, size, mtime_ns) -> probe, least recently used first
+_PROBE_CACHE_SIZE = 128
+_probe_cache = OrderedDict()
+_probe_cache_lock = threading.Lock()
+
+#seconds before a stuck ffprobe/ffmpeg is killed, None waits forever
+#encodes of long videos legitimately take a while so they have no limit by default
+PROBE_TIMEOUT = 30
+ENCODE_TIMEOUT = None
+
+#max ffprobe processes vidprop_batch runs at once, lower it to avoid cpu storms
+MAX_PARALLEL_PROBES = min(32, (os.cpu_count() or 1) * 4)
+
+#the ffprobe stream fields vidprop reads, fetched in a single call
+_VIDEO_FIELDS = ("width", "height", "codec_name", "avg_frame_rate", "duration")
+_get_stream_fields = operator.itemgetter(*_VIDEO_FIELDS)
+
+#send ffprobe calls through one long-lived shell instead of spawning ffprobe from
+#python each time, it serialises probes so it suits single-file callers more than
+#vidprop_batch, and needs bash so it is ignored on windows
+USE_PROBE_SERVER = False
+_PROBE_SERVER_END = "@@END@@"
+_probe_server = None
+_probe_server_lock = threading.Lock()
+
+#suffix for standardised output names, cheaper than a uuid per file
+_output_counter = itertools.count()
+
+#containers whose headers vidprop can read itself without running ffprobe
+_MP4_EXTENSIONS = (".mp4", ".m4v", ".mov")
+
+#mp4 sample entry types and the codec_name ffprobe reports for them
+_MP4_CODECS = {
+    b"avc1": "h264", b"avc3": "h264",
+    b"hvc1": "hevc", b"hev1": "hevc",
+    b"av01": "av1",
+    b"vp09": "vp9",
+    b"mp4v": "mpeg4",
+}
+
+#moov atoms bigger than this are left to ffprobe rather than read into memory
+_MAX_MOOV_SIZE = 64 * 1024 * 1024
+
+#hardware H.264 encoders in order of preference, libx264 is the cpu fallback
+_HW_H264_ENCODERS = ("h264_nvenc", "h264_videotoolbox", "h264_vaapi")
+VAAPI_DEVICE = "/dev/dri/renderD128"
+
+
+class ProbeTimeoutError(TimeoutError):
+    """
+    ffprobe did not finish within the probe timeout
+    """
+
+
+class EncodeTimeoutError(RuntimeError):
+    """
+    ffmpeg did not finish within the encode timeout, a RuntimeError like
+    any other ffmpeg failure so existing handlers still catch it
+    """
+
+
+def _ffprobe_args() -> List[str]:
+    """
+    The ffprobe command asking only for the fields we use, minus the input path
+    """
+    return [
+        "ffprobe", "-v", "error",
+        "-select_streams", "v:0",
+        "-show_entries", "stream=width,height,codec_name,avg_frame_rate,duration",
+        "-of", "json",
+    ]
+
+
+def _run_ffprobe(video_path: str, timeout: float = None) -> Dict:
+    """
+    Calls ffprobe directly asking only for the fields we use
+
+    Returns the parsed json, eg.
+    >>> {'streams': [{'codec_name': 'h264', 'width': 1080, ...}]}
+
+    Raises:
+            ProbeTimeoutError if ffprobe runs longer than timeout seconds
+            ffmpeg.Error if ffprobe fails or is not installed, same as ffmpeg.probe
+    """
+    try:
+        result = subprocess.run(
+            _ffprobe_args() + [video_path],
+            capture_output=True, check=True, timeout=timeout,
+        )
+    except subprocess.TimeoutExpired:
+        raise ProbeTimeoutError(f"ffprobe timed out after {timeout}s on {video_path}") from None
+    except subprocess.CalledProcessError as e:
+        raise ffmpeg.Error("ffprobe", e.stdout, e.stderr) from None
+    except OSError as e:
+        #a missing ffprobe binary would otherwise look like a missing video
+        raise ffmpeg.Error("ffprobe", b"", str(e).encode()) from None
+    return _json_loads(result.stdout)
+
+
+def _probe_via_server(video_path: str, timeout: float = None) -> Dict:
+    """
+    Same as _run_ffprobe but goes through a shell loop that is started once
+    and then reads one path per line on stdin, printing the ffprobe json
+    followed by a "@@END@@ <exit code>" line
+
+    Raises:
+            ProbeTimeoutError if the answer takes longer than timeout seconds,
+            the shell is killed and restarted on the next call
+            ffmpeg.Error if ffprobe fails or the shell can't be started
+    """
+    global _probe_server
+
+    #paths are sent one per line so a newline in the name can't go through the loop
+    if os.name == "nt" or "\n" in video_path:
+        return _run_ffprobe(video_path, timeout=timeout)
+
+    with _probe_server_lock:
+        if _probe_server is None or _probe_server.poll() is not None:
+            script = (
+                "while IFS= read -r f; do "
+                f"{shlex.join(_ffprobe_args())} \"$f\"; "
+                f"echo \"{_PROBE_SERVER_END} $?\"; "
+                "done"
+            )
+            try:
+                _probe_server = subprocess.Popen(
+                    ["bash", "-c", script],
+                    stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                    text=True, bufsize=1, start_new_session=True,
+                )
+            except OSError as e:
+                raise ffmpeg.Error("ffprobe", b"", str(e).encode()) from None
+
+        #killing the shell and its ffprobe on timeout closes stdout, which unblocks readline below
+        server = _probe_server
+        expired = threading.Event()
+        def kill_server():
+            expired.set()
+            try:
+                os.killpg(server.pid, signal.SIGKILL)
+            except OSError:
+                pass
+        timer = threading.Timer(timeout, kill_server) if timeout is not None else None
+
+        lines = []
+        try:
+            if timer is not None:
+                timer.start()
+            server.stdin.write(video_path + "\n")
+            server.stdin.flush()
+            while True:
+                line = server.stdout.readline()
+                if not line:
+                    #the shell died, start a fresh one on the next call
+                    _probe_server = None
+                    if expired.is_set():
+                        raise ProbeTimeoutError(f"ffprobe timed out after {timeout}s on {video_path}")
+                    raise ffmpeg.Error("ffprobe", b"", f"ffprobe server exited while probing {video_path}".encode())
+                if line.startswith(_PROBE_SERVER_END):
+                    returncode = int(line.split()[1])
+                    break
+                lines.append(line)
+        finally:
+            if timer is not None:
+                timer.cancel()
+
+    #the loop sends ffprobe's stderr to /dev/null so only the exit code is known
+    if returncode != 0:
+        raise ffmpeg.Error("ffprobe", b"", f"ffprobe exited with {returncode} on {video_path}".encode())
+    return _json_loads("".join(lines))
+
+
+def _iter_atoms(data: bytes, start: int, end: int) -> Iterator[Tuple[bytes, int, int]]:
+    """
+    Yields (type, body_start, body_end) for each mp4 atom in data[start:end]
+    """
+    pos = start
+    while pos + 8 <= end:
+        size, kind = struct.unpack_from(">I4s", data, pos)
+        header_size = 8
+        if size == 1:
+            #64 bit size follows the type
+            size = struct.unpack_from(">Q", data, pos + 8)[0]
+            header_size = 16
+        elif size == 0:
+            #atom runs to the end of its parent
+            size = end - pos
+        if size < header_size or pos + size > end:
+            return
+        yield kind, pos + header_size, pos + size
+        pos += size
+
+
+def _find_atom(data: bytes, path: Tuple[bytes, ...], start: int, end: int):
+    """
+    Follows path (eg. (b"mdia", b"hdlr")) down from data[start:end],
+    returning the (body_start, body_end) of the last atom or None if missing
+    """
+    for kind in path:
+        for atom_kind, body_start, body_end in _iter_atoms(data, start, end):
+            if atom_kind == kind:
+                start, end = body_start, body_end
+                break
+        else:
+            return None
+    return start, end
+
+
+def _read_moov(f) -> bytes:
+    """
+    Returns the body of the top level moov atom, seeking past mdat so it
+    is found whether the file is faststart or has moov at the end
+    """
+    file_end = f.seek(0, os.SEEK_END)
+    pos = 0
+    while pos + 8 <= file_end:
+        f.seek(pos)
+        header = f.read(16)
+        size, kind = struct.unpack_from(">I4s", header)
+        header_size = 8
+        if size == 1:
+            size = struct.unpack_from(">Q", header, 8)[0]
+            header_size = 16
+        elif size == 0:
+            size = file_end - pos
+        if size < header_size:
+            return None
+        if kind == b"moov":
+            if size > _MAX_MOOV_SIZE:
+                return None
+            f.seek(pos + header_size)
+            return f.read(size - header_size)
+        pos += size
+    return None
+
+
+def _parse_mp4_header(video_path: str) -> Dict:
+    """
+    Reads the first video track of an mp4/mov straight from the moov atom
+
+    Returns the same shape as _run_ffprobe, or None if the file is anything
+    this parser does not handle (fragmented mp4, unknown codec, damaged header)
+    so the caller can fall back to ffprobe
+    """
+    try:
+        with open(video_path, "rb") as f:
+            moov = _read_moov(f)
+        if moov is None:
+            return None
+
+        for kind, trak_start, trak_end in _iter_atoms(moov, 0, len(moov)):
+            if kind != b"trak":
+                continue
+
+            #handler type sits after version/flags and pre_defined
+            hdlr = _find_atom(moov, (b"mdia", b"hdlr"), trak_start, trak_end)
+            if hdlr is None or moov[hdlr[0] + 8:hdlr[0] + 12] != b"vide":
+                continue
+
+            #track timescale and duration, version 1 uses 64 bit times
+            mdhd_start, _ = _find_atom(moov, (b"mdia", b"mdhd"), trak_start, trak_end)
+            if moov[mdhd_start] == 1:
+                timescale, duration = struct.unpack_from(">IQ", moov, mdhd_start + 20)
+            else:
+                timescale, duration = struct.unpack_from(">II", moov, mdhd_start + 12)
+
+            stbl = _find_atom(moov, (b"mdia", b"minf", b"stbl"), trak_start, trak_end)
+            stsd_start, _ = _find_atom(moov, (b"stsd",), *stbl)
+            stts_start, _ = _find_atom(moov, (b"stts",), *stbl)
+
+            #first sample entry: size, type, then width/height 24 bytes into its body
+            codec_name = _MP4_CODECS.get(moov[stsd_start + 12:stsd_start + 16])
+            width, height = struct.unpack_from(">HH", moov, stsd_start + 40)
+
+            #frame count is the sum of the (count, delta) runs in the time-to-sample table
+            entry_count = struct.unpack_from(">I", moov, stts_start + 4)[0]
+            frames = sum(
+                struct.unpack_from(">I", moov, stts_start + 8 + 8 * i)[0]
+                for i in range(entry_count)
+            )
+
+            #fragmented files keep the real duration in moof atoms, leave those to ffprobe
+            if codec_name is None or not (timescale and duration and frames):
+                return None
+
+            return {"streams": [{
+                "width": width,
+                "height": height,
+                "codec_name": codec_name,
+                "avg_frame_rate": f"{frames * timescale}/{duration}",
+                "duration": f"{duration / timescale:.6f}",
+            }]}
+    except (OSError, struct.error, TypeError, IndexError):
+        #TypeError covers unpacking a missing (None) atom
+        return None
+    return None
+
+
+@lru_cache(maxsize=None)
+def _h264_encoder() -> str:
+    """
+    Picks the first hardware H.264 encoder that this ffmpeg build lists and
+    that actually works on this machine, or libx264, checked once per process
+    """
+    try:
+        result = subprocess.run(
+            ["ffmpeg", "-hide_banner", "-encoders"],
+            capture_output=True, check=True, text=True, timeout=PROBE_TIMEOUT,
+        )
+    except (OSError, subprocess.SubprocessError):
+        return "libx264"
+
+    #lines look like " V....D h264_nvenc           NVIDIA NVENC H.264 encoder"
+    available = {line.split()[1] for line in result.stdout.splitlines() if len(line.split()) > 1}
+
+    #builds list hardware encoders even when the hardware is missing (eg. nvenc on
+    #intel machines) so each one is tried on a test pattern before it is trusted
+    for encoder in _HW_H264_ENCODERS:
+        if encoder in available and _encoder_works(encoder):
+            return encoder
+    return "libx264"
+
+
+def _encoder_works(vcodec: str) -> bool:
+    """
+    Encodes a fraction of a second of generated video with vcodec to see if
+    the hardware behind it is really there
+    """
+    input_args, output_args = _encoder_args(vcodec, "null")
+    #there is nothing to decode in a generated test pattern
+    input_args.pop("hwaccel", None)
+    command = (
+        ffmpeg.input("color=size=256x144:rate=30:duration=0.2", f="lavfi", **input_args)
+        .output("-", f="null", vcodec=vcodec, **output_args)
+        .compile()
+    )
+    try:
+        subprocess.run(
+            command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            check=True, timeout=PROBE_TIMEOUT,
+        )
+    except (OSError, subprocess.SubprocessError):
+        return False
+    return True
+
+
+def _encoder_args(vcodec: str, video_filter: str) -> Tuple[Dict, Dict]:
+    """
+    Returns the (input, output) ffmpeg arguments needed to encode with vcodec
+    """
+    if vcodec == "h264_nvenc":
+        #decodes on the gpu as well, frames come back to system memory for pad
+        #since there is no widely available pad filter that runs on cuda frames
+        return {"hwaccel": "cuda"}, {"vf": video_filter, "pix_fmt": "yuv420p"}
+    if vcodec == "h264_vaapi":
+        #vaapi only encodes gpu surfaces so the padded frames are uploaded last
+        return {"vaapi_device": VAAPI_DEVICE}, {"vf": f"{video_filter},format=nv12,hwupload"}
+    return {}, {"vf": video_filter, "pix_fmt": "yuv420p"}
+
+
+def _probe_cached(video_path: str, st: os.stat_result = None, timeout: float = None) -> Dict:
+    """
+    Returns the ffprobe output for video_path, only spawning ffprobe
+    when the file has not been probed before
+
+    Results are cached in memory keyed by (path, size, mtime) and on disk
+    in a <video_path>.probe.json sidecar so repeat calls skip the subprocess
+
+    Pass st if the caller has already stat'ed the file to save another syscall,
+    timeout is the ffprobe limit in seconds if ffprobe has to run
+
+    The returned dict is shared between callers and must not be mutated
+    """
+    if st is None:
+        st = os.stat(video_path)
+
+    #the timeout only matters if ffprobe runs so it is not part of the key
+    key = (os.path.abspath(video_path), st.st_size, st.st_mtime_ns)
+    with _probe_cache_lock:
+        probe = _probe_cache.get(key)
+        if probe is not None:
+            _probe_cache.move_to_end(key)
+            return probe
+
+    probe = _probe_uncached(*key, timeout)
+
+    with _probe_cache_lock:
+        _probe_cache[key] = probe
+        _probe_cache.move_to_end(key)
+        if len(_probe_cache) > _PROBE_CACHE_SIZE:
+            _probe_cache.popitem(last=False)
+    return probe
+
+
+def _probe_uncached(abspath: str, size: int, mtime_ns: int, timeout: float) -> Dict:
+    #mp4/mov headers are quicker to read ourselves than to fork ffprobe for
+    if abspath.lower().endswith(_MP4_EXTENSIONS):
+        probe = _parse_mp4_header(abspath)
+        if probe is not None:
+            return probe
+
+    sidecar = abspath + ".probe.json"
+
+    #trusts the sidecar only if the video has not changed since it was written
+    try:
+        with open(sidecar, "rb") as f:
+            cached = _json_loads(f.read())
+        if (cached.get("version") == _SIDECAR_VERSION
+                and cached["file_size"] == size and cached["mtime_ns"] == mtime_ns):
+            return cached["probe"]
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+
+    if USE_PROBE_SERVER:
+        probe = _probe_via_server(abspath, timeout=timeout)
+    else:
+        probe = _run_ffprobe(abspath, timeout=timeout)
+
+    #writes to a temp file then swaps it in so readers never see a partial sidecar,
+    #mkstemp gives every thread its own temp file when the same video is probed twice at once
+    tmp_path = None
+    try:
+        fd, tmp_path = tempfile.mkstemp(
+            dir=os.path.dirname(sidecar), prefix=os.path.basename(sidecar) + ".", suffix=".tmp"
+        )
+        with os.fdopen(fd, "w") as f:
+            json.dump({"version": _SIDECAR_VERSION, "file_size": size, "mtime_ns": mtime_ns, "probe": probe}, f)
+        os.replace(tmp_path, sidecar)
+    except OSError:
+        #read-only directories just lose the on-disk cache
+        if tmp_path is not None:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+    return probe
+
+
+def _stat_video(video_path: str) -> os.stat_result:
+    """
+    Stats video_path once for the existence check, file size and cache key
+
+    Raises:
+            FileNotFound if file does not exist or is not a regular file
+    """
+    try:
+        st = os.stat(video_path)
+    except OSError:
+        raise FileNotFoundError(f"{video_path} not found") from None
+    if not stat.S_ISREG(st.st_mode):
+        raise FileNotFoundError(f"{video_path} not found")
+    return st
+
+
+def _video_fields(video_path: str, st: os.stat_result, probe_timeout: float = None) -> Dict:
+    """
+    Probes video_path and returns width, height, codec_name, avg_frame_rate
+    and duration with the types vidprop promises
+
+    Raises:
+            ValueError if no video type file is found 
+            ProbeTimeoutError if ffprobe runs longer than probe_timeout (default PROBE_TIMEOUT)
+            ffmpeg.Error if ffprobe fails or is not installed
+    """
+    if probe_timeout is None:
+        probe_timeout = PROBE_TIMEOUT
+
+    #checks if file is video and gets properties, ffprobe only returns the first video stream
+    probe = _probe_cached(video_path, st, probe_timeout)
+    streams = probe.get("streams") or []
+    if not streams:
+        raise ValueError(f"No video stream found in {video_path}")
+    vidprops = streams[0]
+
+    #pulls every field in one go, some containers leave fields out (eg. mkv has no stream duration)
+    try:
+        width, height, codec_name, avg_frame_rate, duration = _get_stream_fields(vidprops)
+    except KeyError:
+        width, height, codec_name, avg_frame_rate, duration = (
+            vidprops.get("width", 0),
+            vidprops.get("height", 0),
+            vidprops.get("codec_name"),
+            vidprops.get("avg_frame_rate", ""),
+            vidprops.get("duration", 0.0),
+        )
+
+    #Turn fps to float, ffprobe always gives "num/den"
+    num, _, den = str(avg_frame_rate).partition("/")
+    try:
+        fps = float(num) / float(den) if den else float(num)
+    except (ValueError, ZeroDivisionError):
+        fps = 0
+
+    return {
+        "width": int(width),
+        "height": int(height),
+        "codec_name": codec_name or None,
+        "avg_frame_rate": fps,
+        "duration": float(duration)
+    }
+
 
-def vidprop(video_path: str) -> Dict:
+def vidprop(video_path: str, probe_timeout: float = None) -> Dict:
     """
     Extracts key metadata from video file 
 
@@ -14,6 +537,8 @@ def vidprop(video_path: str) -> Dict:
 
     Always outputs file name and size
 
+    probe_timeout is the ffprobe limit in seconds (default PROBE_TIMEOUT)
+
     >>>
 
     Returns a dictionary with essential fields for surf engine:
@@ -28,42 +553,146 @@ def vidprop(video_path: str) -> Dict:
     Raises:
             FileNotFound if file does not exist
             ValueError if no video type file is found 
+            ProbeTimeoutError if ffprobe takes longer than probe_timeout
+            ffmpeg.Error if ffprobe fails or is not installed
     """
 
-    #checks if video exists
-    if os.path.isfile(video_path) == False:                     
-        raise FileNotFoundError(f"{video_path} not found") 
-    
-    #checks if file is video and gets properties  
-    probe = ffmpeg.probe(video_path)                                        
-    vidprops = None
-    for prop in probe["streams"]:                                           
-        if prop["codec_type"] == "video":                                   
-            vidprops = prop
-            break                                                                  
-    if vidprops == None:                                                
-        raise ValueError(f"No video stream found in {video_path}")          
+    st = _stat_video(video_path)
 
     #scheme with metadata we want, outputs none or 0 if it doesn't exists
     metadata = {
         "filename": os.path.basename(video_path) or None,
-        "file_size": int(os.path.getsize(video_path)) if os.path.exists(video_path) else 0,
-        "width": int(vidprops.get("width", 0)),
-        "height": int(vidprops.get("height", 0)),
-        "codec_name": vidprops.get("codec_name") or None,
-        "avg_frame_rate": 0.0,
-        "duration": float(vidprops.get("duration", 0.0))
+        "file_size": st.st_size,
     }
+    metadata.update(_video_fields(video_path, st, probe_timeout))
+
+    return metadata 
+
+
+class LazyMetadata:
+    """
+    vidprop output that only runs ffprobe the first time a video field is read
+
+    filename and file_size come from os.stat straight away so callers that
+    only list files never pay for a probe
+
+    >>> meta = LazyMetadata("LOL.mov")
+    >>> meta.file_size     # no probe
+    >>> meta.width         # probes once, fills every video field
+
+    Raises:
+            FileNotFound if file does not exist (when created)
+            ValueError if no video type file is found (when a video field is first read)
+            ProbeTimeoutError if ffprobe takes longer than probe_timeout (same)
+            ffmpeg.Error if ffprobe fails or is not installed (same)
+    """
+    __slots__ = ("_path", "_st", "_probe_timeout", "filename", "file_size") + _VIDEO_FIELDS
+
+    def __init__(self, video_path: str, probe_timeout: float = None):
+        self._path = video_path
+        self._probe_timeout = probe_timeout
+        self._st = _stat_video(video_path)
+        self.filename = os.path.basename(video_path) or None
+        self.file_size = self._st.st_size
+
+    def __getattr__(self, name: str):
+        #only reached for slots that are still empty, ie. video fields before the probe
+        if name not in _VIDEO_FIELDS:
+            raise AttributeError(name)
+        for field, value in _video_fields(self._path, self._st, self._probe_timeout).items():
+            setattr(self, field, value)
+        return getattr(self, name)
+
+    def to_dict(self) -> Dict:
+        """
+        Returns the same dictionary vidprop would, probing if needed
+        """
+        return {name: getattr(self, name) for name in ("filename", "file_size") + _VIDEO_FIELDS}
+
+    def __repr__(self) -> str:
+        return f"LazyMetadata({self._path!r})"
+
+
+def vidprop_batch(
+        video_paths: Iterable[str],
+        max_workers: int = None,
+        probe_timeout: float = None
+        ) -> Iterator[Tuple[str, Dict]]:
+    """
+    Runs vidprop over many files at once
+
+    ffprobe runs out of process so threads are enough to keep every core busy.
+    Results are yielded as (video_path, metadata) in the order they finish,
+    not the order they were given, so callers can start on them straight away
+
+    Args:
+        video_paths: Paths to input video files
+        max_workers (int, optional): Max probes in flight (default MAX_PARALLEL_PROBES)
+        probe_timeout (float, optional): Seconds before a stuck ffprobe is killed,
+            freeing its worker (default PROBE_TIMEOUT)
 
-    #Turn fps to float and insert into metadata 
+    Raises:
+        Whatever vidprop raises for the first file that fails
+    """
+    ex = ThreadPoolExecutor(max_workers=max_workers or MAX_PARALLEL_PROBES)
     try:
-        fps_fraction = Fraction(vidprops.get("avg_frame_rate"))
-        fps_float = float(fps_fraction)
-        metadata["avg_frame_rate"] = fps_float
-    except: 
-        metadata["avg_frame_rate"] = 0
+        futures = {ex.submit(vidprop, path, probe_timeout): path for path in video_paths}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+    except BaseException:
+        #report the failure (or the caller stopping early) straight away instead of
+        #waiting on every other probe, queued probes are dropped
+        ex.shutdown(wait=False, cancel_futures=True)
+        raise
+    ex.shutdown()
+
+
+def _standardise_command(
+        video_path: str,
+        output_path: str,
+        width: int,
+        height: int,
+        vcodec: str
+        ) -> List[str]:
+    """
+    Builds the ffmpeg command line for standardising video_path with vcodec
+    """
+    #scale to fit inside width x height, preserving aspect ratio
+    scale_filter = f"scale=w={width}:h={height}:force_original_aspect_ratio=decrease"
 
-    return metadata 
+    #pad to exactly width x height if needed
+    pad_filter = f"pad={width}:{height}:(ow-iw)/2:(oh-ih)/2"
+
+    #both filters go in one -vf string so ffmpeg parses a single filter graph
+    video_filter = f"{scale_filter},{pad_filter}"
+
+    input_args, output_args = _encoder_args(vcodec, video_filter)
+    source = ffmpeg.input(video_path, **input_args)
+    #"a?" maps audio only if the file has any, so no probe is needed to check
+    #-n makes a name collision fail rather than overwrite or prompt
+    return (
+        ffmpeg.output(
+            source["v:0"], source["a?"], output_path,
+            vcodec=vcodec, acodec='aac', **output_args
+        )
+        .global_args("-n")
+        .compile()
+    )
+
+
+def _standardise_output_path(video_path: str, filetype: str, user_ID: str) -> str:
+    """
+    Builds a unique output filename for a standardised copy of video_path
+    """
+    #takes only the filename root not the ext (eg.mov)
+    filename_root, _ = os.path.splitext(os.path.basename(video_path))
+
+    #timestamps the file for uniqueness if reuploads occur, the pid and counter keep
+    #names unique across processes and within a batch on the same nanosecond
+    unique_ID = f"{time.time_ns():x}_{os.getpid():x}_{next(_output_counter):x}"
+    user_tag = f"{user_ID}_" if user_ID else ""
+
+    return f"{user_tag}{filename_root}_std_at_{unique_ID}.{filetype}"
 
 
 def standardise_video(
@@ -72,7 +701,9 @@ def standardise_video(
         width: int = 1280, 
         height: int = 720, 
         fps: int = 30,
-        user_ID: str = None
+        user_ID: str = None,
+        hwaccel: bool = True,
+        encode_timeout: float = None
         ) -> str:
     """
     Standardise a video to a consistent format
@@ -80,7 +711,7 @@ def standardise_video(
     Standardisation:
       - Resolution: width x height (default 1280x720)
       - Frame rate: fps (default 30)
-      - Video Codec: H.264 
+      - Video Codec: H.264 (on the gpu when ffmpeg has a hardware encoder)
       - Audio Codec: AAC
       - Pixel format: yuv420p
 
@@ -91,61 +722,161 @@ def standardise_video(
         height (int): Target height
         fps (int): Target frames per second
         user_id (str, optional): User identifier 
+        hwaccel (bool): Use a working hardware encoder if there is one, else libx264 (default True)
+        encode_timeout (float, optional): Seconds before ffmpeg is killed (default ENCODE_TIMEOUT)
 
     Returns:
         str: Path to the standardised output file
 
     Raises:
         FileNotFoundError: If input file does not exist
+        EncodeTimeoutError: If ffmpeg takes longer than encode_timeout
         RuntimeError: If ffmpeg fails
     """
     
     #checks if input file exists
     if not os.path.isfile(video_path):
         raise FileNotFoundError(f"{video_path} not found")
-    
-    #check if file has audio 
-    probe = ffmpeg.probe(video_path)
-    has_audio = any([prop["codec_type"] == "audio" for prop in probe["streams"]])
-    audioarg = {"acodec" : "aac"} if has_audio else {}
 
-    #scale to fit inside width x height, preserving aspect ratio
-    scale_filter = f"scale=w={width}:h={height}:force_original_aspect_ratio=decrease"
+    output_path = _standardise_output_path(video_path, filetype, user_ID)
+    if encode_timeout is None:
+        encode_timeout = ENCODE_TIMEOUT
 
-    #pad to exactly width x height if needed
-    pad_filter = f"pad={width}:{height}:(ow-iw)/2:(oh-ih)/2"
-    
-    #takes only the filename root not the ext (eg.mov)
-    filename_root, _ = os.path.splitext(os.path.basename(video_path))
+    #the encoder was already checked to work, so a failure here is down to the input
+    vcodec = _h264_encoder() if hwaccel else "libx264"
+    command = _standardise_command(video_path, output_path, width, height, vcodec)
+    try:
+        result = subprocess.run(
+            command, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+            timeout=encode_timeout,
+        )
+    except subprocess.TimeoutExpired:
+        #run has already killed ffmpeg, so only the partial output is left to clean up
+        try:
+            os.remove(output_path)
+        except OSError:
+            pass
+        raise EncodeTimeoutError(f"FFmpeg timed out after {encode_timeout}s on {video_path}") from None
+    if result.returncode == 0:
+        return output_path
+
+    #raises ffmpeg error if it fails
+    raise RuntimeError(
+        f"FFmpeg failed for {video_path}. "
+        f"Error details: {result.stderr.decode(errors='ignore')}"
+    )
+
+
+async def standardise_video_async(
+        video_path:str, 
+        filetype: str = "mp4", 
+        width: int = 1280, 
+        height: int = 720, 
+        fps: int = 30,
+        user_ID: str = None,
+        hwaccel: bool = True,
+        encode_timeout: float = None
+        ) -> str:
+    """
+    Same as standardise_video but awaits ffmpeg instead of blocking on it
 
-    #timestamps the file for uniqueness if reuploads occur 
-    timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    Raises:
+        FileNotFoundError: If input file does not exist
+        EncodeTimeoutError: If ffmpeg takes longer than encode_timeout
+        RuntimeError: If ffmpeg fails
+    """
+    if not os.path.isfile(video_path):
+        raise FileNotFoundError(f"{video_path} not found")
 
-    #Generates mostly unique UUID
-    unique_ID = uuid.uuid4().hex[:8]
-    user_tag = f"{user_ID}_" if user_ID else ""
+    output_path = _standardise_output_path(video_path, filetype, user_ID)
+    if encode_timeout is None:
+        encode_timeout = ENCODE_TIMEOUT
+
+    #the first call runs the encoder checks, which would otherwise block the event loop
+    vcodec = await asyncio.to_thread(_h264_encoder) if hwaccel else "libx264"
+    command = _standardise_command(video_path, output_path, width, height, vcodec)
+    process = await asyncio.create_subprocess_exec(
+        *command, stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE
+    )
+    try:
+        _, stderr = await asyncio.wait_for(process.communicate(), encode_timeout)
+    except BaseException as e:
+        #a timeout or a cancelled task would otherwise leave ffmpeg writing a partial file
+        try:
+            process.kill()
+        except ProcessLookupError:
+            pass
+        await process.wait()
+        try:
+            os.remove(output_path)
+        except OSError:
+            pass
+        if isinstance(e, asyncio.TimeoutError):
+            raise EncodeTimeoutError(f"FFmpeg timed out after {encode_timeout}s on {video_path}") from None
+        raise
+    if process.returncode == 0:
+        return output_path
+
+    raise RuntimeError(
+        f"FFmpeg failed for {video_path}. "
+        f"Error details: {stderr.decode(errors='ignore')}"
+    )
+
+
+async def standardise_batch(
+        video_paths: Iterable[str],
+        max_probes: int = None,
+        max_encodes: int = 1,
+        probe_timeout: float = None,
+        **standardise_args
+        ) -> List[Tuple[str, Dict]]:
+    """
+    Probes and standardises many videos, overlapping the probes of later
+    files with the encodes of earlier ones
 
-    output_path = f"{user_tag}{filename_root}_std_at_{timestamp}_{unique_ID}.{filetype}"
+    Probing is fork/io bound and encoding is cpu bound so they run side by
+    side; ffmpeg already uses every core so encodes default to one at a time
 
-    try:
-        (    
-            ffmpeg.input(video_path)
-            .filter("scale", f"w={width}:h={height}:force_original_aspect_ratio=decrease")
-            .filter("pad", f"{width}:{height}:(ow-iw)/2:(oh-ih)/2")
-            .output(output_path, vcodec='libx264', **audioarg, pix_fmt='yuv420p')
-            .run()
-        )
-    #raises ffmpeg error if it fails    
-    except ffmpeg.Error as e:
-        raise RuntimeError(
-            f"FFmpeg failed for {video_path}. "
-            f"Error details: {e.stderr.decode(errors='ignore')}"
-        )
-    
-    return output_path
+    Args:
+        video_paths: Paths to input video files
+        max_probes (int, optional): Max probes in flight (default MAX_PARALLEL_PROBES)
+        max_encodes (int): Max ffmpeg encodes in flight (default 1)
+        probe_timeout (float, optional): Seconds before a stuck ffprobe is killed (default PROBE_TIMEOUT)
+        **standardise_args: Passed on to standardise_video_async (eg. width, height, encode_timeout)
 
-# vidprop("LOL.mov")
-# standardise_video("LOL.mov")
+    Returns:
+        list of (output_path, metadata) in the same order as video_paths,
+        where metadata is the vidprop output for the input file
+
+    Raises:
+        Whatever vidprop or standardise_video_async raises for the first file that fails,
+        the other files are cancelled and their ffmpeg processes killed
+    """
+    probe_slots = asyncio.Semaphore(max_probes or MAX_PARALLEL_PROBES)
+    encode_slots = asyncio.Semaphore(max_encodes)
+
+    async def run_one(video_path: str) -> Tuple[str, Dict]:
+        #probing first also rejects files with no video before they take an encode slot
+        async with probe_slots:
+            metadata = await asyncio.to_thread(vidprop, video_path, probe_timeout)
+        async with encode_slots:
+            output_path = await standardise_video_async(video_path, **standardise_args)
+        return output_path, metadata
+
+    tasks = [asyncio.ensure_future(run_one(path)) for path in video_paths]
+    try:
+        return list(await asyncio.gather(*tasks))
+    except BaseException:
+        #one file failing (or the batch being cancelled) stops the encodes still running
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+if __name__ == "__main__":
+    print(vidprop("LOL.mov"))
+    # standardise_video("LOL.mov")
 
 
 